@@ -1,18 +1,19 @@
 
 """Executes dataset import, cleaning, and writing 
-cleaned datapoints and metadata to disk for the 
+cleaned datapoints, regional aggregates and metadata to disk for the 
 World Bank Global Database of Inflation dataset.
 
 Usage:
     python -m main
 """
 
-from worldbank_inflation import download, init_variables_to_clean, clean
+from worldbank_inflation import download, init_variables_to_clean, clean, aggregate
 
 def main():
     download.main()
     init_variables_to_clean.main()
     clean.main()
+    aggregate.main()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""Tests that the aggregate stage only recomputes series-region pairs whose
+member data changed, and keeps its cached output in step with the data.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worldbank_inflation import clean, aggregate  # noqa: E402
+
+ENTITIES = {
+    "AAA": "Country A",
+    "BBB": "Country B",
+    "CCC": "Country C",
+    "DDD": "Country D",
+    "R1": "Region One",
+}
+# R2 has no standardized name, so it is named by its code
+MEMBERSHIP = [
+    ("R1", "AAA", 1.0),
+    ("R1", "BBB", 2.0),
+    ("R2", "BBB", 3.0),
+    ("R2", "CCC", 1.0),
+]
+SERIES = ["series_a", "series_b"]
+YEARS = range(2000, 2005)
+
+
+@pytest.fixture(params=[False, True], ids=["default", "low_memory"])
+def paths(request, monkeypatch, tmp_path):
+    """sets up a config folder and cleaned data points for the aggregate
+    stage in a temporary directory.
+    """
+    configpath = os.path.join(tmp_path, "config")
+    outpath = os.path.join(tmp_path, "output")
+    os.makedirs(configpath)
+    os.makedirs(os.path.join(outpath, "datapoints"))
+
+    pd.DataFrame(
+        {"country_code": list(ENTITIES), "Our World In Data Name": list(ENTITIES.values())}
+    ).to_csv(os.path.join(configpath, "standardized_entity_names.csv"), index=False)
+    write_membership(configpath, MEMBERSHIP)
+
+    rng = np.random.default_rng(0)
+    for series_name in SERIES:
+        df_datapoints = pd.DataFrame(
+            [(country, year) for country in ["Country A", "Country B", "Country C", "Country D"] for year in YEARS],
+            columns=["country", "year"],
+        )
+        df_datapoints["value"] = rng.normal(5, 10, len(df_datapoints)) / 3
+        write_datapoints(outpath, series_name, df_datapoints)
+
+    monkeypatch.setattr(aggregate, "CONFIGPATH", configpath)
+    monkeypatch.setattr(clean, "CONFIGPATH", configpath)
+    monkeypatch.setattr(aggregate, "OUTPATH", outpath)
+    monkeypatch.setattr(aggregate, "LOW_MEMORY", request.param)
+    return configpath, outpath
+
+
+@pytest.fixture
+def recomputed(monkeypatch):
+    """records the series-region pairs passed to `calculate_aggregates()`."""
+    pairs = set()
+    calculate_aggregates = aggregate.calculate_aggregates
+
+    def record(df_members):
+        pairs.update(zip(df_members["series_name"].astype(str), df_members["region_code"].astype(str)))
+        return calculate_aggregates(df_members)
+
+    monkeypatch.setattr(aggregate, "calculate_aggregates", record)
+    return pairs
+
+
+def write_membership(configpath, membership):
+    pd.DataFrame(membership, columns=["region_code", "country_code", "weight"]).to_csv(
+        os.path.join(configpath, "region_membership.csv"), index=False
+    )
+
+
+def write_datapoints(outpath, series_name, df_datapoints):
+    df_datapoints.to_csv(
+        os.path.join(outpath, "datapoints", f"datapoints_{series_name}.csv"), index=False
+    )
+
+
+def read_datapoints(outpath, series_name):
+    return pd.read_csv(os.path.join(outpath, "datapoints", f"datapoints_{series_name}.csv"))
+
+
+def read_output_files(outpath):
+    """returns the bytes of every file in the aggregates folder."""
+    out_path = os.path.join(outpath, aggregate.AGGREGATES_DIR)
+    output = {}
+    for fname in sorted(os.listdir(out_path)):
+        with open(os.path.join(out_path, fname), "rb") as f:
+            output[fname] = f.read()
+    return output
+
+
+def test_first_run_computes_every_pair(paths, recomputed):
+    _, outpath = paths
+    aggregate.main()
+    assert recomputed == {(series, region) for series in SERIES for region in ["R1", "R2"]}
+
+    df_aggregates = pd.read_csv(os.path.join(outpath, "aggregates", "aggregates_series_a.csv"))
+    assert sorted(df_aggregates["region"].unique()) == ["R2", "Region One"]
+    df_r1 = df_aggregates[df_aggregates["region_code"] == "R1"].set_index("year")
+    df_values = read_datapoints(outpath, "series_a").pivot(index="year", columns="country", values="value")
+    expected = (df_values["Country A"] * 1.0 + df_values["Country B"] * 2.0) / 3.0
+    np.testing.assert_allclose(df_r1["weighted_mean"], expected, rtol=1e-6)
+
+
+def test_unchanged_rerun_recomputes_nothing_and_rewrites_identical_files(paths, recomputed):
+    _, outpath = paths
+    aggregate.main()
+    output = read_output_files(outpath)
+    recomputed.clear()
+
+    aggregate.main()
+    assert recomputed == set()
+    assert read_output_files(outpath) == output
+
+
+def test_changed_member_value_recomputes_only_its_regions(paths, recomputed):
+    _, outpath = paths
+    aggregate.main()
+    output = read_output_files(outpath)
+    recomputed.clear()
+
+    # Country C only belongs to R2
+    df_datapoints = read_datapoints(outpath, "series_b")
+    df_datapoints.loc[df_datapoints["country"] == "Country C", "value"] += 1
+    write_datapoints(outpath, "series_b", df_datapoints)
+
+    aggregate.main()
+    assert recomputed == {("series_b", "R2")}
+    new_output = read_output_files(outpath)
+    assert new_output["aggregates_series_a.csv"] == output["aggregates_series_a.csv"]
+    assert new_output["aggregates_series_b.csv"] != output["aggregates_series_b.csv"]
+
+
+def test_missing_cached_rows_are_recomputed(paths, recomputed):
+    _, outpath = paths
+    aggregate.main()
+    output = read_output_files(outpath)
+    recomputed.clear()
+
+    # the digest file is kept, but the rows it describes are gone
+    os.remove(os.path.join(outpath, "aggregates", "aggregates_series_a.csv"))
+
+    aggregate.main()
+    assert recomputed == {("series_a", "R1"), ("series_a", "R2")}
+    assert read_output_files(outpath) == output
+
+
+def test_removed_regions_and_series_are_dropped(paths, recomputed):
+    configpath, outpath = paths
+    aggregate.main()
+    recomputed.clear()
+
+    write_membership(configpath, [row for row in MEMBERSHIP if row[0] != "R2"])
+    os.remove(os.path.join(outpath, "datapoints", "datapoints_series_b.csv"))
+
+    aggregate.main()
+    assert recomputed == set()
+    output = read_output_files(outpath)
+    assert sorted(output) == [aggregate.HASHES_FNAME, "aggregates_series_a.csv"]
+    assert json.loads(output[aggregate.HASHES_FNAME]).keys() == {"series_a"}
+    assert json.loads(output[aggregate.HASHES_FNAME])["series_a"].keys() == {"R1"}
+    df_aggregates = pd.read_csv(os.path.join(outpath, "aggregates", "aggregates_series_a.csv"))
+    assert df_aggregates["region_code"].unique().tolist() == ["R1"]
+
+
+def test_no_datapoints_clears_aggregates(paths):
+    _, outpath = paths
+    aggregate.main()
+    for series_name in SERIES:
+        os.remove(os.path.join(outpath, "datapoints", f"datapoints_{series_name}.csv"))
+
+    aggregate.main()
+    output = read_output_files(outpath)
+    assert sorted(output) == [aggregate.HASHES_FNAME]
+    assert json.loads(output[aggregate.HASHES_FNAME]) == {}
@@ -0,0 +1,135 @@
+"""Runs the clean and aggregate stages on a large synthetic data series in
+low-memory mode, under a peak memory budget, and compares the output with
+the default mode.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import worldbank_inflation  # noqa: E402
+from worldbank_inflation import clean, aggregate  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="peak memory is measured with the resource module"
+)
+
+CONFIGPATH = os.path.join(os.path.dirname(os.path.abspath(worldbank_inflation.__file__)), "config")
+N_SERIES = 300
+YEARS = [str(year) for year in range(1970, 2021)]
+MEMORY_BUDGET_MB = 300
+
+
+@pytest.fixture(scope="module")
+def inpath(tmp_path_factory):
+    """writes a synthetic `WorldBankInflation{DATA_SERIES}.csv.zip` with
+    every standardized entity for each of `N_SERIES` series.
+    """
+    rng = np.random.default_rng(0)
+    codes = pd.read_csv(os.path.join(CONFIGPATH, "standardized_entity_names.csv"))["country_code"]
+    n_rows = len(codes) * N_SERIES
+    values = rng.normal(5, 10, size=(n_rows, len(YEARS)))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    df_data = pd.DataFrame(values, columns=YEARS)
+    df_data.insert(0, "Country Code", np.tile(codes, N_SERIES))
+    df_data.insert(1, "IMF Country Code", 0)
+    df_data.insert(2, "Country", df_data["Country Code"])
+    df_data.insert(3, "Indicator Type", "Inflation")
+    df_data.insert(4, "Series Name", np.repeat([f"Series {i}" for i in range(N_SERIES)], len(codes)))
+
+    path = tmp_path_factory.mktemp("input")
+    df_data.to_csv(
+        os.path.join(path, "WorldBankInflation" + clean.DATA_SERIES + ".csv.zip"),
+        index=False,
+        compression="gzip",
+    )
+    return str(path)
+
+
+def _pipeline_main(inpath, outpath, low_memory, memory_budget_mb):
+    for module in (clean, aggregate):
+        module.CONFIGPATH = CONFIGPATH
+        module.OUTPATH = outpath
+        module.LOW_MEMORY = low_memory
+    clean.INPATH = inpath
+    clean.MEMORY_BUDGET_MB = memory_budget_mb
+    clean.main()
+    aggregate.main()
+
+
+def run_pipeline(inpath, outpath, low_memory, memory_budget_mb):
+    """runs `clean.main()` and `aggregate.main()` in a fresh process so that
+    the peak memory checked against the budget covers this run rather than
+    the test session. On Linux a new process inherits the peak memory of the
+    process that started it, so the test process itself must stay well under
+    the budget. Returns the exit code of the process.
+    """
+    os.makedirs(outpath)
+    with open(os.path.join(outpath, "variables_to_clean.json"), "w") as f:
+        json.dump({"variables": [{"name": f"Series {i}"} for i in range(N_SERIES)]}, f)
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=_pipeline_main, args=(inpath, outpath, low_memory, memory_budget_mb)
+    )
+    process.start()
+    process.join()
+    return process.exitcode
+
+
+def assert_outputs_close(low_outpath, default_outpath, subdir, float_columns):
+    """compares the csv files in `subdir` of both output folders one at a time."""
+    fnames = sorted(f for f in os.listdir(os.path.join(low_outpath, subdir)) if f.endswith(".csv"))
+    assert fnames == sorted(
+        f for f in os.listdir(os.path.join(default_outpath, subdir)) if f.endswith(".csv")
+    )
+    for fname in fnames:
+        assert_frames_close(
+            pd.read_csv(os.path.join(low_outpath, subdir, fname)),
+            pd.read_csv(os.path.join(default_outpath, subdir, fname)),
+            float_columns,
+        )
+    return fnames
+
+
+def assert_frames_close(df_low, df_default, float_columns):
+    assert df_low.shape == df_default.shape
+    pd.testing.assert_frame_equal(
+        df_low.drop(columns=float_columns), df_default.drop(columns=float_columns)
+    )
+    # float32 values keep about 7 significant digits
+    np.testing.assert_allclose(df_low[float_columns], df_default[float_columns], rtol=1e-5, atol=1e-5)
+
+
+def test_low_memory_matches_default_within_budget(inpath, tmp_path):
+    low_outpath = os.path.join(tmp_path, "low_memory")
+    assert run_pipeline(inpath, low_outpath, True, MEMORY_BUDGET_MB) == 0, (
+        f"Low-memory pipeline failed or exceeded the {MEMORY_BUDGET_MB} MB memory budget."
+    )
+    default_outpath = os.path.join(tmp_path, "default")
+    assert run_pipeline(inpath, default_outpath, False, None) == 0
+
+    assert len(assert_outputs_close(low_outpath, default_outpath, "datapoints", ["value"])) == N_SERIES
+    assert len(assert_outputs_close(
+        low_outpath, default_outpath, "aggregates", ["mean", "median", "weighted_mean"]
+    )) == N_SERIES
+
+    for fname in ["distinct_countries_standardized.csv", "datasets.csv"]:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(os.path.join(low_outpath, fname)),
+            pd.read_csv(os.path.join(default_outpath, fname)),
+        )
+
+
+def test_memory_budget_is_enforced(monkeypatch):
+    monkeypatch.setattr(clean, "MEMORY_BUDGET_MB", 1)
+    with pytest.raises(AssertionError, match="exceeds the memory budget of 1 MB"):
+        clean.check_memory_budget("test")
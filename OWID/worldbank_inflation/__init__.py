@@ -14,5 +14,11 @@ CONFIGPATH = os.path.join(DATASET_DIR, "config")
 INPATH = os.path.join(DATASET_DIR, "input")
 OUTPATH = os.path.join(DATASET_DIR, "output")
 
+# Memory constants. LOW_MEMORY carries categorical entities, int16 years and
+# float32 values through every stage. MEMORY_BUDGET_MB is the peak resident
+# memory allowed for the process (None disables the check).
+LOW_MEMORY = False
+MEMORY_BUDGET_MB = None
+
 
 
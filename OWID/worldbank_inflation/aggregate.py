@@ -0,0 +1,256 @@
+"""Computes regional aggregates from cleaned country-level data points.
+
+Usage:
+    python -m worldbank_inflation.aggregate
+"""
+
+import os
+import simplejson as json
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from worldbank_inflation import CONFIGPATH, OUTPATH, LOW_MEMORY
+from worldbank_inflation.clean import get_standard_entities, check_memory_budget
+
+import logging
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+AGGREGATES_DIR = "aggregates"
+HASHES_FNAME = "aggregate_hashes.json"
+KEYS = ["series_name", "region_code"]
+
+
+def main():
+    # loads standardized entity names and region memberships
+    entity2owid_name = get_standard_entities()
+    # both frames share one categorical dtype so the merge below keeps `country` categorical
+    country_dtype = pd.CategoricalDtype(sorted(set(entity2owid_name.values()))) if LOW_MEMORY else None
+    df_membership = load_region_membership(entity2owid_name, country_dtype)
+
+    # loads every cleaned series and attaches the regions each country belongs to
+    df_datapoints = load_datapoints(set(df_membership["country"]), country_dtype)
+    if df_datapoints.empty:
+        # drops aggregates left by a previous run, as their data no longer exists
+        write_aggregates(pd.DataFrame(columns=KEYS), {})
+        return
+    df_members = df_datapoints.merge(df_membership, on="country", how="inner")
+    del df_datapoints
+
+    # compares member data against the cache to find regions needing recomputation.
+    # pairs are also recomputed if their cached rows are missing, e.g. after a
+    # failed write, so a stale digest file can never hide missing aggregates.
+    region_hashes = hash_region_members(df_members)
+    cached_hashes = load_cached_hashes()
+    df_cached = load_cached_aggregates()
+    cached_keys = set() if df_cached.empty else set(df_cached.set_index(KEYS).index)
+    stale = [
+        key for key, digest in region_hashes.items()
+        if cached_hashes.get(key) != digest or key not in cached_keys
+    ]
+    logger.info(
+        f"Recomputing aggregates for {len(stale)} of {len(region_hashes)} series-region pairs..."
+    )
+
+    if stale:
+        is_stale = pd.MultiIndex.from_frame(df_members[KEYS]).isin(stale)
+        df_new = calculate_aggregates(df_members[is_stale])
+    else:
+        df_new = pd.DataFrame(columns=KEYS)
+    df_aggregates = combine_with_cache(df_cached, df_new, region_hashes.keys(), stale)
+
+    write_aggregates(df_aggregates, region_hashes)
+    check_memory_budget("aggregate")
+
+def load_region_membership(entity2owid_name: dict, country_dtype=None) -> pd.DataFrame:
+    """loads the mapping of region codes to member country codes from
+    `{CONFIGPATH}/region_membership.csv` and attaches standardized names.
+
+    Arguments:
+        entity2owid_name: dict. Mapping of entity codes to standardized OWID
+            names, as returned by `clean.get_standard_entities()`.
+        country_dtype: pd.CategoricalDtype. Dtype of the `country` column
+            when `LOW_MEMORY` is set, shared with `load_datapoints()`.
+    Returns:
+        df_membership: pd.DataFrame. One row per region-country pair with
+            columns `region_code`, `region`, `country` and `weight`.
+    """
+    df_membership = pd.read_csv(os.path.join(CONFIGPATH, "region_membership.csv"))
+    df_membership["weight"] = df_membership["weight"].fillna(1.0)
+    assert not df_membership.duplicated(subset=["region_code", "country_code"]).any(), (
+        "Each country should only be listed once per region in region_membership.csv."
+    )
+    unknown = set(df_membership["country_code"]) - set(entity2owid_name)
+    assert not unknown, f"Unknown country codes in region_membership.csv: {sorted(unknown)}"
+
+    df_membership["country"] = df_membership["country_code"].map(entity2owid_name)
+    # custom regions without a standardized name keep their code as the name
+    df_membership["region"] = df_membership["region_code"].map(entity2owid_name).fillna(
+        df_membership["region_code"]
+    )
+    df_membership = df_membership[["region_code", "region", "country", "weight"]]
+    if LOW_MEMORY:
+        df_membership = df_membership.astype({
+            "region_code": "category",
+            "region": "category",
+            "country": country_dtype,
+            "weight": "float32",
+        })
+    return df_membership
+
+def load_datapoints(countries: set, country_dtype=None) -> pd.DataFrame:
+    """loads every `datapoints_{series_name}.csv` file written by
+    `clean.clean_and_create_datapoints()` into a single long dataframe
+    with a `series_name` column. Returns an empty dataframe if `clean`
+    did not write any data points.
+
+    Arguments:
+        countries: set. Standardized names of the countries that belong to
+            at least one region. Rows of other countries are dropped as
+            each file is read, so they are never held in memory together.
+        country_dtype: pd.CategoricalDtype. Dtype of the `country` column
+            when `LOW_MEMORY` is set. Every file is read with the same
+            categories so that concatenating them keeps the column categorical.
+    Returns:
+        df_datapoints: pd.DataFrame. Columns `country`, `year`, `value` and
+            `series_name`.
+    """
+    out_path = os.path.join(OUTPATH, "datapoints")
+    fnames = sorted(
+        fname for fname in os.listdir(out_path)
+        if fname.startswith("datapoints_") and fname.endswith(".csv")
+    )
+    if not fnames:
+        logger.info(f"No data points found in {out_path}, skipping aggregation.")
+        return pd.DataFrame()
+    series_names = [fname[len("datapoints_"):-len(".csv")] for fname in fnames]
+    dtypes = {"country": country_dtype, "year": "int16", "value": "float32"} if LOW_MEMORY else None
+    frames = []
+    for i, (fname, series_name) in enumerate(zip(fnames, series_names)):
+        df_temp = pd.read_csv(os.path.join(out_path, fname), dtype=dtypes)
+        is_member = df_temp["country"].isin(countries)
+        if LOW_MEMORY:
+            assert df_temp["country"].notnull().all(), f"Unknown country names in {fname}."
+            series_name = pd.Categorical.from_codes(
+                np.full(is_member.sum(), i), categories=series_names
+            )
+        frames.append(df_temp[is_member].assign(series_name=series_name))
+    return pd.concat(frames, ignore_index=True)
+
+def hash_region_members(df_members: pd.DataFrame) -> Dict[tuple, str]:
+    """returns a digest of the member data points of each series-region pair.
+
+    Row hashes are summed within each group, so the digest does not depend
+    on row order but changes whenever a member value, year, weight, the
+    region name or the membership itself changes.
+    """
+    row_hashes = pd.util.hash_pandas_object(
+        df_members[KEYS + ["region", "country", "year", "value", "weight"]], index=False
+    )
+    digests = row_hashes.groupby([df_members[key] for key in KEYS], observed=True).sum()
+    return {key: format(int(digest), "016x") for key, digest in digests.items()}
+
+def calculate_aggregates(df_members: pd.DataFrame) -> pd.DataFrame:
+    """calculates the mean, median and weighted mean of member countries
+    for every series, region and year in a single groupby.
+    """
+    df_members = df_members.assign(weighted_value=df_members["value"] * df_members["weight"])
+    df_aggregates = (
+        df_members.groupby(KEYS + ["region", "year"], observed=True)
+        .agg(
+            mean=pd.NamedAgg(column="value", aggfunc="mean"),
+            median=pd.NamedAgg(column="value", aggfunc="median"),
+            weighted_value=pd.NamedAgg(column="weighted_value", aggfunc="sum"),
+            weight=pd.NamedAgg(column="weight", aggfunc="sum"),
+            n_countries=pd.NamedAgg(column="country", aggfunc="nunique"),
+        )
+        .reset_index()
+    )
+    df_aggregates["weighted_mean"] = df_aggregates["weighted_value"] / df_aggregates["weight"]
+    return df_aggregates.drop(columns=["weighted_value", "weight"])
+
+def combine_with_cache(
+    df_cached: pd.DataFrame, df_new: pd.DataFrame, keys, stale: List[tuple]
+) -> pd.DataFrame:
+    """returns freshly calculated aggregates together with the cached
+    aggregates of every series-region pair that is still current.
+    """
+    if df_cached.empty:
+        return df_new
+    df_cached = df_cached.set_index(KEYS)
+    keep = df_cached.index.isin(list(keys)) & ~df_cached.index.isin(stale)
+    df_cached = df_cached[keep].reset_index()
+    # concatenating an empty frame would turn integer columns into floats
+    frames = [df for df in (df_cached, df_new) if not df.empty]
+    return pd.concat(frames, ignore_index=True) if frames else df_new
+
+def load_cached_hashes() -> Dict[tuple, str]:
+    """loads the member digests saved by the previous run, if any."""
+    fpath = os.path.join(OUTPATH, AGGREGATES_DIR, HASHES_FNAME)
+    if not os.path.exists(fpath):
+        return {}
+    with open(fpath, "r") as f:
+        hashes = json.load(f)
+    return {
+        (series_name, region_code): digest
+        for series_name, regions in hashes.items()
+        for region_code, digest in regions.items()
+    }
+
+def load_cached_aggregates() -> pd.DataFrame:
+    """loads the aggregates saved by the previous run, if any. Floats are
+    parsed with round-trip precision so rewriting unchanged aggregates does
+    not alter the saved files. If `LOW_MEMORY` is set they are read as
+    float32, like freshly calculated aggregates, since mixing the two would
+    upcast and rewrite the float32 values with float64 precision.
+    """
+    out_path = os.path.join(OUTPATH, AGGREGATES_DIR)
+    if not os.path.exists(out_path):
+        return pd.DataFrame()
+    dtypes = {"mean": "float32", "median": "float32", "weighted_mean": "float32"} if LOW_MEMORY else None
+    frames = []
+    for fname in os.listdir(out_path):
+        if fname.startswith("aggregates_") and fname.endswith(".csv"):
+            df_temp = pd.read_csv(
+                os.path.join(out_path, fname), dtype=dtypes, float_precision="round_trip"
+            )
+            df_temp["series_name"] = fname[len("aggregates_"):-len(".csv")]
+            frames.append(df_temp)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def write_aggregates(df_aggregates: pd.DataFrame, region_hashes: Dict[tuple, str]) -> None:
+    """saves the aggregates for each series to
+    `{OUTPATH}/aggregates/aggregates_{series_name}.csv` along with the
+    member digests used to detect changes on the next run. The digests are
+    removed first and only written back once every csv has been saved.
+    """
+    out_path = os.path.join(OUTPATH, AGGREGATES_DIR)
+    hashes_path = os.path.join(out_path, HASHES_FNAME)
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    if os.path.exists(hashes_path):
+        os.remove(hashes_path)
+    for fname in os.listdir(out_path):
+        if fname.startswith("aggregates_") and fname.endswith(".csv"):
+            os.remove(os.path.join(out_path, fname))
+
+    columns = ["region_code", "region", "year", "mean", "median", "weighted_mean", "n_countries"]
+    for series_name, gp in df_aggregates.groupby("series_name", observed=True):
+        gp = gp.sort_values(["region_code", "year"])
+        assert not gp.duplicated(subset=["region_code", "year"]).any()
+        gp[columns].to_csv(os.path.join(out_path, f"aggregates_{series_name}.csv"), index=False)
+
+    hashes = {}
+    for (series_name, region_code), digest in region_hashes.items():
+        hashes.setdefault(series_name, {})[region_code] = digest
+    with open(hashes_path + ".tmp", "w") as f:
+        json.dump(hashes, f, indent=4, sort_keys=True)
+    os.replace(hashes_path + ".tmp", hashes_path)
+    logger.info(f"Saved aggregates for {len(hashes)} series to {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ Usage:
 """
 
 import os
+import sys
 import simplejson as json
 import shutil
 from typing import List, Dict
@@ -18,9 +19,16 @@ from worldbank_inflation import (
     CONFIGPATH,
     INPATH,
     OUTPATH,
-    DATA_SERIES
+    DATA_SERIES,
+    LOW_MEMORY,
+    MEMORY_BUDGET_MB
 )
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 import logging
 
 logging.basicConfig()
@@ -30,7 +38,7 @@ logger.setLevel(logging.INFO)
 
 def main():
     #removing prior data in preparation for replacement
-    delete_output(keep_paths=["variables_to_clean.json"])
+    delete_output(keep_paths=["variables_to_clean.json", "aggregates"])
 
     # loads variables to be cleaned and uploaded.
     variables_to_clean = load_variables_to_clean()
@@ -43,6 +51,7 @@ def main():
 
     #cleans datapoints and saves to disk
     clean_and_create_datapoints(variables_to_clean, entity2owid_name)
+    check_memory_budget("clean_and_create_datapoints")
     assert (
         df_datasets.shape[0] == 1
     ), f"Only expected one dataset in {os.path.join(OUTPATH, 'datasets.csv')}."
@@ -51,6 +60,7 @@ def main():
 
     #saving metadata to disk
     write_metadata(df_datasets, df_distinct_entities)
+    check_memory_budget("clean")
 
 def load_variables_to_clean() -> List[dict]:
     """loads the array of variables to clean."""
@@ -100,6 +110,42 @@ def delete_output(keep_paths: List[str]) -> None:
         if os.path.exists(os.path.join(OUTPATH, "..", path)):
             os.rename(os.path.join(OUTPATH, "..", path), os.path.join(OUTPATH, path))
 
+def check_memory_budget(stage: str) -> None:
+    """asserts that the peak resident memory of the process so far is
+    within `MEMORY_BUDGET_MB`. Does nothing if no budget is set.
+
+    Arguments:
+        stage: str. Name of the stage that just finished, used in messages.
+    Returns:
+        None.
+    """
+    if MEMORY_BUDGET_MB is None:
+        return
+    if resource is None:
+        logger.warning(f"Cannot measure peak memory on {sys.platform}, skipping budget check.")
+        return
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == "darwin":
+        peak_rss_mb /= 1024
+    assert peak_rss_mb <= MEMORY_BUDGET_MB, (
+        f"Peak memory of {peak_rss_mb:.0f} MB after {stage} exceeds the "
+        f"memory budget of {MEMORY_BUDGET_MB} MB."
+    )
+    logger.info(f"Peak memory after {stage}: {peak_rss_mb:.0f} MB of {MEMORY_BUDGET_MB} MB budget.")
+
+def read_data_series(fpath: str) -> pd.DataFrame:
+    """loads a downloaded data series. If `LOW_MEMORY` is set, only the
+    columns used for cleaning are loaded, with categorical codes and
+    names and float32 values.
+    """
+    if not LOW_MEMORY:
+        return pd.read_csv(fpath, compression="gzip")
+    header = pd.read_csv(fpath, compression="gzip", nrows=0).columns
+    dtypes = {col: "float32" for col in header[header.str.contains(r"^\d{4}$")]}
+    dtypes.update({"Country Code": "category", "Series Name": "category"})
+    return pd.read_csv(fpath, compression="gzip", usecols=list(dtypes), dtype=dtypes)
+
 def clean_datasets():
     """Constructs a dataframe where each row represents a dataset cleaned for visualization."""
     data = [
@@ -114,7 +160,7 @@ def clean_and_create_datapoints(variable_names: List[str], entity2owid_name: dic
     The data for each variable is saved as a separate csv file.
     """
     # loads data
-    df_data = pd.read_csv(os.path.join(INPATH, "WorldBankInflation" + DATA_SERIES + ".csv.zip"), compression="gzip")
+    df_data = read_data_series(os.path.join(INPATH, "WorldBankInflation" + DATA_SERIES + ".csv.zip"))
     df_data.columns = df_data.columns.str.lower().str.replace(r"[\s/-]+", "_", regex=True)
     
     years = (
@@ -125,7 +171,15 @@ def clean_and_create_datapoints(variable_names: List[str], entity2owid_name: dic
     df_data = df_data[df_data["series_name"].isin(variable_names)]
 
     # standardizes entity names
-    df_data["country"] = df_data["country_code"].apply(lambda x: entity2owid_name[x])
+    if LOW_MEMORY:
+        # maps each category once rather than each row, and sorts the resulting
+        # categories so data points are written in the same order as below
+        country = df_data["country_code"].map(entity2owid_name)
+        assert country.notnull().all(), "Unknown country codes in data series."
+        country = country.astype("category")
+        df_data["country"] = country.cat.reorder_categories(sorted(country.cat.categories))
+    else:
+        df_data["country"] = df_data["country_code"].apply(lambda x: entity2owid_name[x])
 
     df_data["series_name"] = df_data["series_name"].str.lower().str.replace(r"[\s/-]+", "_", regex=True)
 
@@ -147,7 +201,7 @@ def clean_and_create_datapoints(variable_names: List[str], entity2owid_name: dic
             .reset_index()
             .rename(columns={"level_1": "year", 0: "value"})
         )
-        gp_long["year"] = gp_long["year"].astype(int)
+        gp_long["year"] = gp_long["year"].astype("int16" if LOW_MEMORY else int)
         assert not gp_long.duplicated(subset=["country", "year"]).any()
         assert is_numeric_dtype(gp_long["value"])
         assert is_numeric_dtype(gp_long["year"])
@@ -186,7 +240,7 @@ def get_distinct_entities() -> List[str]:
     ]
     entities = set({})
     for fname in fnames:
-        df_temp = pd.read_csv(os.path.join(OUTPATH, "datapoints", fname))
+        df_temp = pd.read_csv(os.path.join(OUTPATH, "datapoints", fname), usecols=["country"])
         entities.update(df_temp["country"].unique().tolist())
 
     entity_list = sorted(entities)
@@ -28,7 +28,8 @@ def main():
     variables_to_clean = sorted(variables_to_clean, key=lambda x: x["name"])
 
     #removes data in output in preparation for writing new data
-    delete_output()
+    #keeps cached regional aggregates so only changed regions are recomputed
+    delete_output(keep_paths=["aggregates"])
     with open(os.path.join(OUTPATH, "variables_to_clean.json"), "w") as f:
         json.dump(
             {
@@ -69,10 +70,14 @@ def get_new_variables(series):
         "Expected only 1 variable.")
     return df_variables
 
-def delete_output() -> None:
-    """deletes all files in `{DATASET_DIR}/output`, and creates output folder if 
+def delete_output(keep_paths: List[str] = []) -> None:
+    """deletes all files in `{DATASET_DIR}/output` EXCEPT for any file
+    names in `keep_paths`, and creates output folder if 
     it does not already exist
     """
+    for path in keep_paths:
+        if os.path.exists(os.path.join(OUTPATH, path)):
+            os.rename(os.path.join(OUTPATH, path), os.path.join(OUTPATH, "..", path))
     if os.path.exists(OUTPATH):
         shutil.rmtree(OUTPATH, ignore_errors=True)
         if not os.path.exists(OUTPATH):
@@ -80,6 +85,10 @@ def delete_output() -> None:
     else:
         os.makedirs(OUTPATH)
 
+    for path in keep_paths:
+        if os.path.exists(os.path.join(OUTPATH, "..", path)):
+            os.rename(os.path.join(OUTPATH, "..", path), os.path.join(OUTPATH, path))
+
 
 
 if __name__ == "__main__":
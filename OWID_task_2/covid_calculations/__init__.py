@@ -10,5 +10,11 @@ DATASET_DIR = os.path.dirname(__file__).split("/")[-1]
 INPATH = os.path.join(DATASET_DIR, "input")
 OUTPATH = os.path.join(DATASET_DIR, "output")
 
+# Memory constants. LOW_MEMORY reads locations and codes as categoricals and
+# numeric columns as float32. MEMORY_BUDGET_MB is the peak resident memory
+# allowed for the process (None disables the check).
+LOW_MEMORY = False
+MEMORY_BUDGET_MB = None
+
 
 
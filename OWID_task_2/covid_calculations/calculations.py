@@ -5,6 +5,7 @@ Usage:
 """
 
 import os
+import sys
 import shutil
 from typing import List
 import pandas as pd
@@ -14,9 +15,48 @@ from covid_calculations import (
     OUTPATH,
     DATASET_RETRIEVED_DATE,
     TARGET_DATE,
-    YEAR
+    YEAR,
+    LOW_MEMORY,
+    MEMORY_BUDGET_MB
 )
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import logging
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# columns used from vaccinations.csv by calculate_estimates
+VACCINATION_COLUMNS = [
+    "location",
+    "iso_code",
+    "date",
+    "daily_people_vaccinated",
+    "people_vaccinated",
+    "people_vaccinated_per_hundred",
+]
+
+# columns and compact dtypes loaded for each input file when LOW_MEMORY is set
+INPUT_DTYPES = {
+    "vaccinations.csv": {
+        "location": "category",
+        "iso_code": "category",
+        "date": "str",
+        "daily_people_vaccinated": "float32",
+        "people_vaccinated": "float32",
+        "people_vaccinated_per_hundred": "float32",
+    },
+    "population_latest.csv": {
+        "iso_code": "category",
+        "population": "float32",
+    },
+}
+
 def main():
     #removing prior data in preparation for replacement
     delete_output()
@@ -25,6 +65,7 @@ def main():
     population_latest = get_csv_input("population_latest.csv")
 
     estimates = calculate_estimates(vaccinations, population_latest)
+    check_memory_budget("calculate_estimates")
     
     write_estimates(estimates, "estimates.csv")
  
@@ -65,29 +106,29 @@ def calculate_estimates(vaccinations, population_latest):
      towards the WHO initial vaccination protocol goal
     """
     vaccinations['date'] = pd.to_datetime(vaccinations['date'])
-    vaccinations = vaccinations.sort_values(['location', 'date'], ascending=[True, True])
 
     #Filtering for dates earlier than DATASET_RETRIEVED_DATE
     #This only filters if running for a date in the past rather than today's date
-    vaccinations = vaccinations[vaccinations['date'] <= DATASET_RETRIEVED_DATE] 
-
-    #dropping rows without a value for daily initial vaccine protocol completions
-    vaccinations = vaccinations[vaccinations['daily_people_vaccinated'].notna()]
+    #and dropping rows without a value for daily initial vaccine protocol completions.
+    #Both filters and the column selection are a single .loc copy, sorted afterwards
+    #so that only the kept rows are sorted
+    keep = (vaccinations['date'] <= DATASET_RETRIEVED_DATE) & vaccinations['daily_people_vaccinated'].notna()
+    vaccinations = vaccinations.loc[keep, VACCINATION_COLUMNS].sort_values(['location', 'date'], ascending=[True, True])
 
-    vaccinations['most_recent_date'] = vaccinations.groupby('iso_code')['date'].transform('max')
+    #the sorted frame is a new object, so the column is added without another copy
+    vaccinations['most_recent_date'] = vaccinations.groupby('iso_code', observed=True)['date'].transform('max')
 
     #filtering for most recent 14 days of data for each location 
     vaccinations = vaccinations[vaccinations['date'] > vaccinations['most_recent_date'] - pd.DateOffset(days = 14)]
 
     #Group by location and calculate the rate of initial vaccination protocol completions over this period
     location_level_vaccinations = vaccinations.groupby(
-        ['location','iso_code', 'most_recent_date']
+        ['location','iso_code', 'most_recent_date'], observed=True
         ).agg(
             daily_people_vaccinated_rate=pd.NamedAgg(column='daily_people_vaccinated', aggfunc='mean'),
             people_vaccinated = pd.NamedAgg(column='people_vaccinated', aggfunc='last'),
             people_vaccinated_per_hundred = pd.NamedAgg(column='people_vaccinated_per_hundred', aggfunc='last'),
         ).reset_index()
-    location_level_vaccinations['target_date'] = pd.to_datetime(TARGET_DATE)
 
     #filtering for locations that either reported data in the past 30 days or
     #already reached the vaccination target
@@ -100,11 +141,19 @@ def calculate_estimates(vaccinations, population_latest):
     location_level_vaccinations['people_vaccinated_by_target_date'] = (
         location_level_vaccinations['people_vaccinated'] +
         location_level_vaccinations['daily_people_vaccinated_rate'] * 
-        (location_level_vaccinations['target_date'] - location_level_vaccinations['most_recent_date']).dt.days
+        (pd.to_datetime(TARGET_DATE) - location_level_vaccinations['most_recent_date']).dt.days
         )
 
     #merge in population data
-    combined_data = pd.merge(location_level_vaccinations, population_latest[['iso_code', 'population']],on='iso_code',how='left')
+    if LOW_MEMORY:
+        #looks up population by code rather than merging, which copies every column of both frames
+        population = population_latest.dropna(subset=['iso_code']).drop_duplicates('iso_code')
+        combined_data = location_level_vaccinations
+        combined_data['population'] = combined_data['iso_code'].astype(str).map(
+            population.set_index(population['iso_code'].astype(str))['population']
+        )
+    else:
+        combined_data = pd.merge(location_level_vaccinations, population_latest[['iso_code', 'population']],on='iso_code',how='left')
 
     #estimating population for locations without a listed population in the population_lastest.csv file
     #a more complete version of this code would use exact numbers from primary sources to avoid rounding errors
@@ -134,11 +183,43 @@ def calculate_estimates(vaccinations, population_latest):
     return combined_data[['location', 'iso_code', 'Year', 'status']].rename(columns={"location": "Entity", "iso_code": "Code"}) 
 
 def get_csv_input(filename):
-    """loads input data in csv format from {INPATH}
+    """loads input data in csv format from {INPATH}. If LOW_MEMORY is set,
+    only the columns in INPUT_DTYPES are loaded, using compact dtypes.
     """
+    if LOW_MEMORY:
+        dtypes = INPUT_DTYPES[filename]
+        input = pd.read_csv(os.path.join(INPATH, filename), usecols=list(dtypes), dtype=dtypes)
+        #categories are read in order of appearance, sorting them keeps groupby output in name order
+        for col in input.select_dtypes("category"):
+            input[col] = input[col].cat.reorder_categories(sorted(input[col].cat.categories))
+        return input
     input = pd.read_csv(os.path.join(INPATH, filename))
     return input
 
+def check_memory_budget(stage: str) -> None:
+    """asserts that the peak resident memory of the process so far is
+    within `MEMORY_BUDGET_MB`. Does nothing if no budget is set.
+
+    Arguments:
+        stage: str. Name of the stage that just finished, used in messages.
+    Returns:
+        None.
+    """
+    if MEMORY_BUDGET_MB is None:
+        return
+    if resource is None:
+        logger.warning(f"Cannot measure peak memory on {sys.platform}, skipping budget check.")
+        return
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == "darwin":
+        peak_rss_mb /= 1024
+    assert peak_rss_mb <= MEMORY_BUDGET_MB, (
+        f"Peak memory of {peak_rss_mb:.0f} MB after {stage} exceeds the "
+        f"memory budget of {MEMORY_BUDGET_MB} MB."
+    )
+    logger.info(f"Peak memory after {stage}: {peak_rss_mb:.0f} MB of {MEMORY_BUDGET_MB} MB budget.")
+
 
 def write_estimates(estimates, filename):
     estimates.to_csv(os.path.join(OUTPATH, filename), index=False)
@@ -0,0 +1,117 @@
+"""Runs the vaccination estimates on large synthetic inputs in low-memory
+mode, under a peak memory budget, and compares the output with the default
+mode.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from covid_calculations import calculations, DATASET_RETRIEVED_DATE  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="peak memory is measured with the resource module"
+)
+
+N_LOCATIONS = 2000
+N_DAYS = 800
+CHUNK_LOCATIONS = 100
+MEMORY_BUDGET_MB = 350
+
+
+@pytest.fixture(scope="module")
+def inpath(tmp_path_factory):
+    """writes synthetic `vaccinations.csv` and `population_latest.csv` files.
+    Locations vaccinate at different rates, some stop reporting early and
+    only half of them have a listed population, so every status and branch
+    of `calculate_estimates()` is exercised. The file is written in chunks
+    to keep the test process small (see `run_calculations()`).
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(end=DATASET_RETRIEVED_DATE, periods=N_DAYS).strftime("%Y-%m-%d")
+    population = rng.uniform(1e5, 1e8, N_LOCATIONS)
+    daily_rate = population * rng.uniform(0.0002, 0.0012, N_LOCATIONS)
+    iso_codes = np.array([f"L{i:04d}" for i in range(N_LOCATIONS)])
+
+    path = tmp_path_factory.mktemp("input")
+    for start in range(0, N_LOCATIONS, CHUNK_LOCATIONS):
+        chunk = slice(start, start + CHUNK_LOCATIONS)
+        n_chunk = len(iso_codes[chunk])
+        daily = rng.uniform(0.5, 1.5, (n_chunk, N_DAYS)) * daily_rate[chunk, None]
+        # some locations stop reporting well before the retrieval date
+        daily[rng.random(n_chunk) < 0.1, -60:] = np.nan
+        daily[rng.random(daily.shape) < 0.2] = np.nan
+        people_vaccinated = np.nancumsum(daily, axis=1)
+        df_vaccinations = pd.DataFrame({
+            "location": np.repeat([f"Location {i}" for i in range(start, start + n_chunk)], N_DAYS),
+            "iso_code": np.repeat(iso_codes[chunk], N_DAYS),
+            "date": np.tile(dates, n_chunk),
+            "total_vaccinations": (people_vaccinated * 2).ravel(),
+            "people_vaccinated": people_vaccinated.ravel(),
+            "daily_people_vaccinated": daily.ravel(),
+            "people_vaccinated_per_hundred": (people_vaccinated / population[chunk, None] * 100).ravel(),
+            "people_fully_vaccinated": (people_vaccinated * 0.9).ravel(),
+            "daily_vaccinations": daily.ravel(),
+        })
+        df_vaccinations.to_csv(
+            os.path.join(path, "vaccinations.csv"), index=False, mode="a", header=start == 0
+        )
+
+    df_population = pd.DataFrame({
+        "entity": iso_codes[::2],
+        "iso_code": iso_codes[::2],
+        "population": population[::2],
+    })
+    df_population.to_csv(os.path.join(path, "population_latest.csv"), index=False)
+    return str(path)
+
+
+def _calculations_main(inpath, outpath, low_memory, memory_budget_mb):
+    calculations.INPATH = inpath
+    calculations.OUTPATH = outpath
+    calculations.LOW_MEMORY = low_memory
+    calculations.MEMORY_BUDGET_MB = memory_budget_mb
+    calculations.main()
+
+
+def run_calculations(inpath, outpath, low_memory, memory_budget_mb):
+    """runs `calculations.main()` in a fresh process so that the peak memory
+    checked against the budget covers this run rather than the test session.
+    On Linux a new process inherits the peak memory of the process that
+    started it, so the test process itself must stay well under the budget.
+    Returns the exit code of the process.
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=_calculations_main, args=(inpath, outpath, low_memory, memory_budget_mb)
+    )
+    process.start()
+    process.join()
+    return process.exitcode
+
+
+def test_low_memory_matches_default_within_budget(inpath, tmp_path):
+    low_outpath = os.path.join(tmp_path, "low_memory")
+    assert run_calculations(inpath, low_outpath, True, MEMORY_BUDGET_MB) == 0, (
+        f"Low-memory calculations failed or exceeded the {MEMORY_BUDGET_MB} MB memory budget."
+    )
+    default_outpath = os.path.join(tmp_path, "default")
+    assert run_calculations(inpath, default_outpath, False, None) == 0
+
+    df_low = pd.read_csv(os.path.join(low_outpath, "estimates.csv"))
+    df_default = pd.read_csv(os.path.join(default_outpath, "estimates.csv"))
+    assert df_default["status"].nunique() == 3
+    pd.testing.assert_frame_equal(df_low, df_default)
+
+
+def test_memory_budget_is_enforced(monkeypatch):
+    monkeypatch.setattr(calculations, "MEMORY_BUDGET_MB", 1)
+    with pytest.raises(AssertionError, match="exceeds the memory budget of 1 MB"):
+        calculations.check_memory_budget("test")